@@ -0,0 +1,226 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import zlib
+from app.config import settings
+
+logger = logging.getLogger('uvicorn')
+
+AUDIO = 'audio'
+TRANSCRIPT = 'transcript'
+FILE_EXTENSIONS = {AUDIO: 'webm', TRANSCRIPT: 'jsonl'}
+_CLOSE = object()
+_STOP = object()
+# A WebM stream starts with the EBML element; everything before the first Cluster is its header
+EBML_ID = b'\x1a\x45\xdf\xa3'
+WEBM_CLUSTER_ID = b'\x1f\x43\xb6\x75'
+STALE_CHECK_SECONDS = 5.0
+# Headers outlive idle files (a muted mic pauses the recorder) and only go on close,
+# or after this long without audio for sessions whose close record was lost
+HEADER_TTL_SECONDS = 24 * 60 * 60
+
+
+class _Segment:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.size = 0
+        self.opened_at = time.monotonic()
+        self.written_at = self.opened_at
+
+
+class SessionArchiver:
+    """Records per-session audio and transcripts without touching the event loop.
+
+    Callers on the event loop only enqueue records; a small pool of writer threads
+    owns every file handle. Each session is pinned to one writer so its records
+    stay in order. When a writer's queue is full, records are dropped and counted
+    instead of making the live audio path wait. Audio may only fill `queue_size`
+    slots; the `reserved_size` slots above that are kept for transcripts, close
+    records and a session's first audio chunk, which carries the WebM header.
+    """
+
+    def __init__(self, directory, writers=2, queue_size=1000, reserved_size=200,
+                 max_bytes=10_000_000, max_seconds=600, compress=False):
+        self.directory = directory
+        self.queue_size = queue_size
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+        self.queues = [queue.Queue(maxsize=queue_size + reserved_size) for _ in range(writers)]
+        self.threads = []
+        # Sessions whose first audio chunk has been accepted
+        self.audio_sessions = set()
+        self.counters = {
+            'enqueued': 0, 'dropped_audio': 0, 'dropped_transcript': 0, 'dropped_close': 0,
+        }
+        # Each writer keeps its own counters so threads never update the same dict
+        self.writer_counters = [
+            {'written_bytes': 0, 'rotations': 0, 'errors': 0} for _ in range(writers)
+        ]
+
+    def start(self):
+        if self.threads:
+            return
+        for index, records in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._writer, args=(records, self.writer_counters[index]),
+                name=f'archive-writer-{index}', daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        for records in self.queues:
+            try:
+                records.put((_STOP, None, None), timeout=timeout)
+            except queue.Full:
+                # The writer is stuck or gone; its threads are daemons, so don't hang shutdown
+                logger.error('Archive writer did not drain its queue, abandoning it')
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def record_audio(self, session_id, data):
+        if session_id in self.audio_sessions:
+            self._enqueue(session_id, AUDIO, data, 'dropped_audio', reserved=False)
+        elif self._enqueue(session_id, AUDIO, data, 'dropped_audio', reserved=True):
+            self.audio_sessions.add(session_id)
+
+    def record_transcript(self, session_id, role, content):
+        record = {'time': time.time(), 'role': role, 'content': content}
+        self._enqueue(session_id, TRANSCRIPT, record, 'dropped_transcript', reserved=True)
+
+    def close_session(self, session_id):
+        self.audio_sessions.discard(session_id)
+        self._enqueue(session_id, _CLOSE, None, 'dropped_close', reserved=True)
+
+    def _enqueue(self, session_id, kind, payload, dropped, reserved):
+        if not self.threads:
+            return False
+        records = self.queues[zlib.crc32(session_id.encode()) % len(self.queues)]
+        # Only the event loop puts records, so qsize can only be lower than we read
+        if not reserved and records.qsize() >= self.queue_size:
+            self.counters[dropped] += 1
+            return False
+        try:
+            records.put_nowait((kind, session_id, payload))
+        except queue.Full:
+            # Drop rather than block: a lost record is better than a stalled session
+            self.counters[dropped] += 1
+            return False
+        self.counters['enqueued'] += 1
+        return True
+
+    def _writer(self, records, counters):
+        segments = {}
+        # Per-session (WebM header, last audio time), replayed at the start of rotated audio files
+        headers = {}
+        next_stale_check = time.monotonic() + STALE_CHECK_SECONDS
+        while True:
+            # Sweep on a timer rather than on an empty queue, which a busy writer never sees
+            if time.monotonic() >= next_stale_check:
+                self._close_stale(segments, headers, counters)
+                next_stale_check = time.monotonic() + STALE_CHECK_SECONDS
+            try:
+                kind, session_id, payload = records.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if kind is _STOP:
+                break
+            try:
+                if kind is _CLOSE:
+                    headers.pop(session_id, None)
+                    for key in [key for key in segments if key[0] == session_id]:
+                        self._finish(segments.pop(key), counters)
+                else:
+                    self._write(segments, headers, counters, session_id, kind, payload)
+            except Exception as e:
+                counters['errors'] += 1
+                logger.error(f'Archive write failed for session {session_id}: {e}')
+        for segment in segments.values():
+            self._finish(segment, counters)
+
+    def _write(self, segments, headers, counters, session_id, kind, payload):
+        if kind == TRANSCRIPT:
+            payload = (json.dumps(payload) + '\n').encode()
+        header = None
+        now = time.monotonic()
+        if kind == AUDIO:
+            # MediaRecorder only sends the header in the first chunk of a session
+            if session_id in headers:
+                header = headers[session_id][0]
+                headers[session_id] = (header, now)
+            elif payload.startswith(EBML_ID):
+                cluster = payload.find(WEBM_CLUSTER_ID)
+                headers[session_id] = (payload[:cluster] if cluster > 0 else payload, now)
+        key = (session_id, kind)
+        segment = segments.get(key)
+        if segment is not None and (
+            segment.size >= self.max_bytes or now - segment.opened_at >= self.max_seconds
+        ):
+            self._finish(segments.pop(key), counters)
+            counters['rotations'] += 1
+            segment = None
+        if segment is None:
+            segment = segments[key] = self._open(session_id, kind)
+            if header is not None:
+                segment.file.write(header)
+                segment.size += len(header)
+        segment.file.write(payload)
+        segment.size += len(payload)
+        segment.written_at = now
+        counters['written_bytes'] += len(payload)
+
+    def _open(self, session_id, kind):
+        session_dir = os.path.join(self.directory, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        index = len([name for name in os.listdir(session_dir) if name.startswith(kind)])
+        path = os.path.join(session_dir, f'{kind}-{stamp}-{index:04d}.{FILE_EXTENSIONS[kind]}')
+        return _Segment(path)
+
+    def _finish(self, segment, counters):
+        # A failure here loses one file, never the writer thread and every session on it
+        try:
+            segment.file.close()
+            if self.compress:
+                with open(segment.path, 'rb') as source, gzip.open(f'{segment.path}.gz', 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(segment.path)
+        except Exception as e:
+            counters['errors'] += 1
+            logger.error(f'Archive close failed for {segment.path}: {e}')
+
+    def _close_stale(self, segments, headers, counters):
+        # Sessions whose close record was dropped still get their files closed once idle
+        now = time.monotonic()
+        for key in [key for key, segment in segments.items() if now - segment.written_at >= self.max_seconds]:
+            self._finish(segments.pop(key), counters)
+        for session_id in [
+            session_id for session_id, (_, seen) in headers.items() if now - seen >= HEADER_TTL_SECONDS
+        ]:
+            del headers[session_id]
+
+    def metrics(self):
+        metrics = {**self.counters, 'queued': sum(records.qsize() for records in self.queues)}
+        for counters in self.writer_counters:
+            for name, value in counters.items():
+                metrics[name] = metrics.get(name, 0) + value
+        return metrics
+
+
+archiver = SessionArchiver(
+    settings.ARCHIVE_DIR,
+    writers=settings.ARCHIVE_WRITERS,
+    queue_size=settings.ARCHIVE_QUEUE_SIZE,
+    reserved_size=settings.ARCHIVE_RESERVED_SIZE,
+    max_bytes=settings.ARCHIVE_MAX_BYTES,
+    max_seconds=settings.ARCHIVE_MAX_SECONDS,
+    compress=settings.ARCHIVE_COMPRESS,
+)
@@ -1,4 +1,5 @@
 import asyncio
+import uuid
 import httpx
 import re
 import string
@@ -9,6 +10,8 @@ from deepgram import (
 )
 from groq import AsyncGroq
 from app.config import settings
+from app.scheduler import scheduler, estimate_tokens
+from app.archiver import archiver
 
 DEEPGRAM_TTS_URL = 'https://api.deepgram.com/v1/speak?model=aura-luna-en'
 SYSTEM_PROMPT = """You are a helpful and enthusiastic assistant. Speak in a human, conversational tone.
@@ -34,6 +37,7 @@ groq = AsyncGroq(api_key=settings.GROQ_API_KEY)
 class Assistant:
     def __init__(self, websocket, memory_size=10):
         self.websocket = websocket
+        self.session_id = uuid.uuid4().hex
         self.transcript_parts = []
         self.transcript_queue = asyncio.Queue()
         self.system_message = {'role': 'system', 'content': SYSTEM_PROMPT}
@@ -45,7 +49,12 @@ class Assistant:
         self.dg_connection = None
 
     async def assistant_chat(self, messages, model='llama3-8b-8192'):
-        res = await groq.chat.completions.create(messages=messages, model=model)
+        async with scheduler.slot(
+            'groq', self.session_id, cost=estimate_tokens(messages), first_turn=len(messages) <= 2
+        ) as grant:
+            res = await groq.chat.completions.create(messages=messages, model=model)
+            if res.usage:
+                grant.used = res.usage.total_tokens
         return res.choices[0].message.content
     
     def should_end_conversation(self, text):
@@ -58,7 +67,9 @@ class Assistant:
             'Authorization': f'Token {settings.DEEPGRAM_API_KEY}',
             'Content-Type': 'application/json'
         }
-        async with self.httpx_client.stream(
+        async with scheduler.slot(
+            'deepgram_tts', self.session_id, cost=len(text), first_turn=len(self.chat_messages) <= 2
+        ), self.httpx_client.stream(
             'POST', DEEPGRAM_TTS_URL, headers=headers, json={'text': text}
         ) as res:
             async for chunk in res.aiter_bytes(1024):
@@ -70,6 +81,7 @@ class Assistant:
             while not self.finish_event.is_set():
                 try:
                     data = await asyncio.wait_for(self.websocket.receive_bytes(), timeout=5.0)
+                    archiver.record_audio(self.session_id, data)
                     print("Received {len(data)} bytes of audio data")
                     await self.dg_connection.send(data)
                 except asyncio.TimeoutError:
@@ -114,6 +126,7 @@ class Assistant:
                 # Receive audio stream from the client and send it to Deepgram to transcribe it
                 data = await self.websocket.receive_bytes()
                 if data:
+                    archiver.record_audio(self.session_id, data)
                     await self.dg_connection.send(data)
                 else:
                     # Send an empty buffer to keep the connection alive
@@ -126,6 +139,7 @@ class Assistant:
         while not self.finish_event.is_set():
             transcript = await self.transcript_queue.get()
             if transcript['type'] == 'speech_final':
+                archiver.record_transcript(self.session_id, 'user', transcript['content'])
                 if self.should_end_conversation(transcript['content']):
                     self.finish_event.set()
                     await self.websocket.send_json({'type': 'finish'})
@@ -136,6 +150,7 @@ class Assistant:
                     [self.system_message] + self.chat_messages[-self.memory_size:]
                 )
                 self.chat_messages.append({'role': 'assistant', 'content': response})
+                archiver.record_transcript(self.session_id, 'assistant', response)
                 await self.websocket.send_json({'type': 'assistant', 'content': response})
                 await self.text_to_speech(response)
             else:
@@ -165,6 +180,7 @@ class Assistant:
         finally:
             if self.keep_alive_task:
                 self.keep_alive_task.cancel()
+            archiver.close_session(self.session_id)
             await self.httpx_client.aclose()
             if self.websocket.client_state != WebSocketState.DISCONNECTED:
                 await self.websocket.close()
@@ -5,6 +5,24 @@ class Settings(BaseSettings):
     ALLOW_ORIGINS: str = '*'
     DEEPGRAM_API_KEY: str
     OPENAI_API_KEY: str
+    # Upstream request scheduling, shared by all sessions in the process
+    OPENAI_MAX_CONCURRENCY: int = 8
+    OPENAI_TOKENS_PER_MINUTE: int = 200000
+    GROQ_MAX_CONCURRENCY: int = 8
+    GROQ_TOKENS_PER_MINUTE: int = 30000
+    DEEPGRAM_TTS_MAX_CONCURRENCY: int = 8
+    DEEPGRAM_TTS_CHARS_PER_MINUTE: int = 100000
+    SHORT_REQUEST_TOKENS: int = 200
+    SHORT_TTS_CHARS: int = 60
+    # Per-session audio and transcript archiving for QA
+    ARCHIVE_ENABLED: bool = True
+    ARCHIVE_DIR: str = 'data/archive'
+    ARCHIVE_WRITERS: int = 2
+    ARCHIVE_QUEUE_SIZE: int = 1000
+    ARCHIVE_RESERVED_SIZE: int = 200
+    ARCHIVE_MAX_BYTES: int = 10_000_000
+    ARCHIVE_MAX_SECONDS: int = 600
+    ARCHIVE_COMPRESS: bool = False
     model_config = SettingsConfigDict(env_file='.env')
 
 settings = Settings()
\ No newline at end of file
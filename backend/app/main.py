@@ -1,10 +1,21 @@
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
 from app.openai_assistant import Assistant
+from app.scheduler import scheduler
+from app.archiver import archiver
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.ARCHIVE_ENABLED:
+        archiver.start()
+    yield
+    # Joining the writers flushes and closes any open recordings
+    await asyncio.to_thread(archiver.stop)
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +30,15 @@ app.add_middleware(
 def health_check():
     return 'ok'
 
+# Async so it runs on the event loop, which is the only thread the scheduler may touch
+@app.get('/metrics/upstream')
+async def upstream_metrics():
+    return scheduler.metrics()
+
+@app.get('/metrics/archive')
+def archive_metrics():
+    return archiver.metrics()
+
 @app.websocket('/listen')
 async def websocket_listen(websocket: WebSocket):
     await websocket.accept()
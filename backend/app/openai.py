@@ -1,4 +1,5 @@
 import asyncio
+import uuid
 import httpx
 import re
 import string
@@ -8,6 +9,8 @@ from deepgram import (
 )
 from openai import AsyncOpenAI
 from app.config import settings
+from app.scheduler import scheduler, estimate_tokens
+from app.archiver import archiver
 
 DEEPGRAM_TTS_URL = 'https://api.deepgram.com/v1/speak?model=aura-luna-en'
 SYSTEM_PROMPT = """You are a helpful and enthusiastic assistant. Speak in a human, conversational tone.
@@ -34,6 +37,7 @@ openai = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 class Assistant:
     def __init__(self, websocket, memory_size=10):
         self.websocket = websocket
+        self.session_id = uuid.uuid4().hex
         self.transcript_parts = []
         self.transcript_queue = asyncio.Queue()
         self.system_message = {'role': 'system', 'content': SYSTEM_PROMPT}
@@ -43,10 +47,15 @@ class Assistant:
         self.finish_event = asyncio.Event()
     
     async def assistant_chat(self, messages, model='gpt-4o-mini', assistant_id='asst_JlpZ8gVj7jkzujLsY3s5yhOr'):
-        chat_completion = await openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": "Hello world"}]
-        )
+        async with scheduler.slot(
+            'openai', self.session_id, cost=estimate_tokens(messages), first_turn=len(messages) <= 2
+        ) as grant:
+            chat_completion = await openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": "Hello world"}]
+            )
+            if chat_completion.usage:
+                grant.used = chat_completion.usage.total_tokens
         print(chat_completion)
         return chat_completion.choices[0].message.content
 
@@ -62,7 +71,9 @@ class Assistant:
             'Authorization': f'Token {settings.DEEPGRAM_API_KEY}',
             'Content-Type': 'application/json'
         }
-        async with self.httpx_client.stream(
+        async with scheduler.slot(
+            'deepgram_tts', self.session_id, cost=len(text), first_turn=len(self.chat_messages) <= 2
+        ), self.httpx_client.stream(
             'POST', DEEPGRAM_TTS_URL, headers=headers, json={'text': text}
         ) as res:
             async for chunk in res.aiter_bytes(1024):
@@ -98,11 +109,11 @@ class Assistant:
             raise Exception('Failed to connect to Deepgram')
         
         try:
-            audio_file = open('audio.webm', 'wb')
             while not self.finish_event.is_set():
                 # Receive audio stream from the client and send it to Deepgram to transcribe it
                 print('openai Transcribing...')
                 data = await self.websocket.receive_bytes()
+                archiver.record_audio(self.session_id, data)
                 await dg_connection.send(data)
         except Exception as e:
             print('Error:', e)
@@ -115,6 +126,7 @@ class Assistant:
             print('Waiting for transcript...')
             transcript = await self.transcript_queue.get()
             if transcript['type'] == 'speech_final':
+                archiver.record_transcript(self.session_id, 'user', transcript['content'])
                 if self.should_end_conversation(transcript['content']):
                     self.finish_event.set()
                     await self.websocket.send_json({'type': 'finish'})
@@ -125,6 +137,7 @@ class Assistant:
                     [self.system_message] + self.chat_messages[-self.memory_size:]
                 )
                 self.chat_messages.append({'role': 'assistant', 'content': response})
+                archiver.record_transcript(self.session_id, 'assistant', response)
                 await self.websocket.send_json({'type': 'assistant', 'content': response})
                 await self.text_to_speech(response)
             else:
@@ -138,6 +151,7 @@ class Assistant:
         except* WebSocketDisconnect:
             print('Client disconnected')
         finally:
+            archiver.close_session(self.session_id)
             await self.httpx_client.aclose()
             if self.websocket.client_state != WebSocketState.DISCONNECTED:
                 await self.websocket.close()
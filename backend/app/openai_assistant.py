@@ -1,4 +1,5 @@
 import asyncio
+import uuid
 import httpx
 import re
 import string
@@ -11,6 +12,8 @@ from deepgram import (
 import logging
 from openai import AsyncOpenAI
 from app.config import settings
+from app.scheduler import scheduler, estimate_tokens
+from app.archiver import archiver
 
 logger = logging.getLogger("uvicorn")
 
@@ -36,6 +39,7 @@ openai = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 class Assistant:
     def __init__(self, websocket, memory_size=10):
         self.websocket = websocket
+        self.session_id = uuid.uuid4().hex
         self.transcript_parts = []
         self.transcript_queue = asyncio.Queue()
         self.system_message = {'role': 'system', 'content': SYSTEM_PROMPT}
@@ -45,23 +49,28 @@ class Assistant:
         self.finish_event = asyncio.Event()
 
     async def assistant_chat(self, messages, model='gpt-4o-mini', assistant_id='asst_JlpZ8gVj7jkzujLsY3s5yhOr'):
-        thread = await openai.beta.threads.create(messages=messages[1:-2])
-        await openai.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=messages[-1]["content"],
-        )
-        run = await openai.beta.threads.runs.create_and_poll(
-            thread_id=thread.id,
-            assistant_id=assistant_id,
+        async with scheduler.slot(
+            'openai', self.session_id, cost=estimate_tokens(messages), first_turn=len(messages) <= 2
+        ) as grant:
+            thread = await openai.beta.threads.create(messages=messages[1:-2])
+            await openai.beta.threads.messages.create(
+                thread_id=thread.id,
+                role="user",
+                content=messages[-1]["content"],
             )
-        if run.status == 'completed': 
-            response = await openai.beta.threads.messages.list(
-                thread_id=thread.id
-            )
-            logger.info(f"Assistant response: {response.data[0].content[0].text}")
-        else:
-            logger.info(f"Assistant response: No response. Run status: {run.status}")
+            run = await openai.beta.threads.runs.create_and_poll(
+                thread_id=thread.id,
+                assistant_id=assistant_id,
+                )
+            if run.usage:
+                grant.used = run.usage.total_tokens
+            if run.status == 'completed': 
+                response = await openai.beta.threads.messages.list(
+                    thread_id=thread.id
+                )
+                logger.info(f"Assistant response: {response.data[0].content[0].text}")
+            else:
+                logger.info(f"Assistant response: No response. Run status: {run.status}")
         return response.data[0].content[0].text.value
     
     def should_end_conversation(self, text):
@@ -74,7 +83,9 @@ class Assistant:
             'Authorization': f'Token {settings.DEEPGRAM_API_KEY}',
             'Content-Type': 'application/json'
         }
-        async with self.httpx_client.stream(
+        async with scheduler.slot(
+            'deepgram_tts', self.session_id, cost=len(text), first_turn=len(self.chat_messages) <= 2
+        ), self.httpx_client.stream(
             'POST', DEEPGRAM_TTS_URL, headers=headers, json={'text': text}
         ) as res:
             async for chunk in res.aiter_bytes(1024):
@@ -146,6 +157,7 @@ class Assistant:
                 logger.info('Assistant Transcribing...')
                 data = await self.websocket.receive_bytes()
                 if isinstance(data, bytes):
+                    archiver.record_audio(self.session_id, data)
                     await dg_connection.send(data)
                 else:
                     logger.info(f"Received non-bytes data: {type(data)} {data}")
@@ -165,6 +177,7 @@ class Assistant:
                     break
 
                 if transcript['type'] == 'speech_final':
+                    archiver.record_transcript(self.session_id, 'user', transcript['content'])
                     if self.should_end_conversation(transcript['content']):
                         self.finish_event.set()
                         try:
@@ -178,6 +191,7 @@ class Assistant:
                         [self.system_message] + self.chat_messages[-self.memory_size:]
                     )
                     self.chat_messages.append({'role': 'assistant', 'content': response})
+                    archiver.record_transcript(self.session_id, 'assistant', response)
                     await self.websocket.send_json({'type': 'assistant', 'content': response})
                     await self.text_to_speech(response)
                 else:
@@ -207,6 +221,7 @@ class Assistant:
             logger.error(f"Unexpected error in run: {e}")
         finally:
             self.finish_event.set()
+            archiver.close_session(self.session_id)
             await self.httpx_client.aclose()
             if self.websocket.client_state != WebSocketState.DISCONNECTED:
                 await self.websocket.close()
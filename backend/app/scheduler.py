@@ -0,0 +1,223 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from app.config import settings
+
+logger = logging.getLogger('uvicorn')
+
+
+@dataclass
+class ProviderLimits:
+    # Maximum number of requests in flight to the provider at any time
+    max_concurrency: int
+    # Budget of tokens (or characters, for TTS) the provider accepts per minute
+    tokens_per_minute: int
+    # Requests costing at most this much, in the same unit, are treated as short
+    short_request_cost: int = 0
+
+
+@dataclass(order=True)
+class _Waiter:
+    tag: float
+    seq: int
+    session_id: str = field(compare=False)
+    cost: int = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Grant:
+    def __init__(self, cost):
+        self.cost = cost
+        # Set by the caller to the usage the provider reported, to correct the estimate
+        self.used = None
+
+
+class _Provider:
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        self.in_flight = 0
+        self.tokens = float(limits.tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.waiters = []
+        # Virtual clock for weighted fair queuing across sessions
+        self.virtual_time = 0.0
+        self.session_tags = {}
+        # Requests queued or in flight per session, to know when its tag can go
+        self.session_requests = {}
+        self.wakeup = None
+        self.requests = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # (dispatched_at, wait) pairs for percentiles over the recent window
+        self.recent_waits = deque(maxlen=10000)
+
+    def refill(self, now):
+        rate = self.limits.tokens_per_minute / 60
+        self.tokens = min(
+            self.limits.tokens_per_minute, self.tokens + (now - self.refilled_at) * rate
+        )
+        self.refilled_at = now
+
+
+class UpstreamScheduler:
+    """Process-wide scheduler for upstream LLM and TTS requests.
+
+    Requests to each provider are limited by concurrency and a token-rate budget.
+    Waiting requests are served in weighted fair order across sessions, so a busy
+    session cannot starve the others. First-turn and short requests are sorted as
+    if they cost less, but their session is still charged the full cost, so the
+    boost is bounded and fairness still decides between sessions.
+    """
+
+    def __init__(self, limits, priority_weight=0.5, wait_window=60.0):
+        self.providers = {name: _Provider(name, provider_limits) for name, provider_limits in limits.items()}
+        self.priority_weight = priority_weight
+        self.wait_window = wait_window
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, provider, session_id, cost=1, first_turn=False):
+        state = self.providers[provider]
+        # Never ask for more than a full bucket, or the request could never run
+        cost = max(1, min(int(cost), state.limits.tokens_per_minute))
+        await self._acquire(state, session_id, cost, first_turn)
+        grant = Grant(cost)
+        try:
+            yield grant
+        finally:
+            if grant.used is not None:
+                # Refund or charge the difference; a negative balance just delays later requests
+                state.tokens = min(
+                    state.limits.tokens_per_minute, state.tokens + grant.cost - grant.used
+                )
+            self._release(state, session_id)
+
+    async def _acquire(self, state, session_id, cost, first_turn):
+        start = max(state.virtual_time, state.session_tags.get(session_id, 0.0))
+        state.session_tags[session_id] = start + cost
+        state.session_requests[session_id] = state.session_requests.get(session_id, 0) + 1
+        if first_turn or cost <= state.limits.short_request_cost:
+            tag = start + cost * self.priority_weight
+        else:
+            tag = start + cost
+        waiter = _Waiter(
+            tag, next(self._seq), session_id, cost, time.monotonic(),
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(state.waiters, waiter)
+        self._dispatch(state)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as the caller went away, hand it back
+                self._release(state, session_id)
+            else:
+                self._forget_request(state, session_id)
+            raise
+
+    def _release(self, state, session_id):
+        state.in_flight -= 1
+        self._forget_request(state, session_id)
+        self._dispatch(state)
+
+    def _forget_request(self, state, session_id):
+        remaining = state.session_requests[session_id] - 1
+        if remaining:
+            state.session_requests[session_id] = remaining
+        else:
+            # Nothing queued or in flight: drop the session so ended ones don't pile up
+            del state.session_requests[session_id]
+            del state.session_tags[session_id]
+
+    def _dispatch(self, state):
+        now = time.monotonic()
+        state.refill(now)
+        while state.waiters and state.in_flight < state.limits.max_concurrency:
+            waiter = state.waiters[0]
+            if waiter.future.done():
+                heapq.heappop(state.waiters)
+                continue
+            if state.tokens < waiter.cost:
+                self._schedule_wakeup(state, waiter.cost - state.tokens)
+                return
+            heapq.heappop(state.waiters)
+            state.tokens -= waiter.cost
+            state.in_flight += 1
+            # Discounted tags can sort below one already served; never move the clock back
+            state.virtual_time = max(state.virtual_time, waiter.tag)
+            self._record_wait(state, now, now - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _schedule_wakeup(self, state, deficit):
+        if state.wakeup is not None:
+            return
+        delay = deficit / (state.limits.tokens_per_minute / 60)
+
+        def wakeup():
+            state.wakeup = None
+            self._dispatch(state)
+
+        state.wakeup = asyncio.get_running_loop().call_later(delay, wakeup)
+
+    def _record_wait(self, state, now, wait):
+        state.requests += 1
+        state.recent_waits.append((now, wait))
+        state.wait_total += wait
+        state.wait_max = max(state.wait_max, wait)
+        if wait > 1.0:
+            logger.info(f'Upstream request to {state.name} waited {wait:.2f}s in queue')
+
+    def metrics(self):
+        # Not thread-safe: call from the event loop, like every other method here
+        metrics = {}
+        now = time.monotonic()
+        for name, state in self.providers.items():
+            while state.recent_waits and now - state.recent_waits[0][0] > self.wait_window:
+                state.recent_waits.popleft()
+            recent = sorted(wait for _, wait in state.recent_waits)
+            metrics[name] = {
+                'requests': state.requests,
+                'in_flight': state.in_flight,
+                'queued': sum(1 for waiter in state.waiters if not waiter.future.done()),
+                'queue_wait_avg_seconds': state.wait_total / state.requests if state.requests else 0.0,
+                'queue_wait_max_seconds': state.wait_max,
+                'window_seconds': self.wait_window,
+                'window_requests': len(recent),
+                'window_wait_p50_seconds': percentile(recent, 0.50),
+                'window_wait_p95_seconds': percentile(recent, 0.95),
+                'window_wait_p99_seconds': percentile(recent, 0.99),
+            }
+        return metrics
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def estimate_tokens(messages):
+    # Rough estimate of ~4 characters per token, plus room for a short reply.
+    # Callers report the real usage on the grant once the provider answers.
+    return sum(len(message['content']) for message in messages) // 4 + 64
+
+
+scheduler = UpstreamScheduler({
+    'openai': ProviderLimits(
+        settings.OPENAI_MAX_CONCURRENCY, settings.OPENAI_TOKENS_PER_MINUTE, settings.SHORT_REQUEST_TOKENS
+    ),
+    'groq': ProviderLimits(
+        settings.GROQ_MAX_CONCURRENCY, settings.GROQ_TOKENS_PER_MINUTE, settings.SHORT_REQUEST_TOKENS
+    ),
+    'deepgram_tts': ProviderLimits(
+        settings.DEEPGRAM_TTS_MAX_CONCURRENCY, settings.DEEPGRAM_TTS_CHARS_PER_MINUTE, settings.SHORT_TTS_CHARS
+    ),
+})
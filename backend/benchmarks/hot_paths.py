@@ -0,0 +1,369 @@
+"""Micro-benchmarks for the per-session hot paths of the websocket assistant.
+
+Runs fully offline: the client websocket, the Deepgram live connection and the
+TTS endpoint are replaced with in-process fakes, so only our own code is timed.
+
+    python -m benchmarks.hot_paths --save benchmarks/baseline.json
+    python -m benchmarks.hot_paths --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Callable
+
+# Settings require API keys at import time; the benchmarks never call out
+os.environ.setdefault('DEEPGRAM_API_KEY', 'benchmark')
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+import httpx
+from starlette.websockets import WebSocketState
+from deepgram import LiveTranscriptionEvents
+from app import openai_assistant
+from app.openai_assistant import Assistant
+from app.archiver import SessionArchiver
+from app.config import settings
+from app.scheduler import UpstreamScheduler, ProviderLimits
+
+FRAME = bytes(2048)
+TTS_AUDIO = bytes(48 * 1024)
+TTS_TEXT = 'Sure! The nearest coffee shop is two blocks north, and it opens at seven.'
+UTTERANCE = ['what is', 'what is the weather', 'what is the weather like']
+END_TEXTS = [
+    'Thanks, that is all for today. Goodbye!',
+    'Can you tell me more about the second option?',
+    'Okay bye.',
+    'I was saying goodbye to my friend yesterday and she said hi.',
+]
+
+
+class FakeWebSocket:
+    client_state = WebSocketState.CONNECTED
+
+    def __init__(self, assistant, frames=1):
+        self.assistant = assistant
+        self.frames = frames
+        self.sent = 0
+
+    async def receive_bytes(self):
+        self.frames -= 1
+        if self.frames <= 0:
+            self.assistant.finish_event.set()
+        return FRAME
+
+    async def send_json(self, data):
+        self.sent += 1
+
+    async def send_bytes(self, data):
+        self.sent += 1
+
+    async def close(self):
+        self.client_state = WebSocketState.DISCONNECTED
+
+
+class FakeDeepgramConnection:
+    def __init__(self):
+        self.handlers = {}
+        self.sent = 0
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    async def start(self, options):
+        return True
+
+    async def send(self, data):
+        self.sent += len(data)
+
+    async def finish(self):
+        return True
+
+
+class FakeDeepgramClient:
+    def __init__(self):
+        self.connection = FakeDeepgramConnection()
+        self.listen = SimpleNamespace(asynclive=SimpleNamespace(v=lambda version: self.connection))
+
+
+def transcript_result(sentence, is_final, speech_final=False):
+    return SimpleNamespace(
+        channel=SimpleNamespace(alternatives=[SimpleNamespace(transcript=sentence)]),
+        is_final=is_final,
+        speech_final=speech_final,
+    )
+
+
+def make_assistant(frames=1):
+    assistant = Assistant(None)
+    assistant.websocket = FakeWebSocket(assistant, frames)
+    return assistant
+
+
+@contextmanager
+def patched(name, value):
+    """Replaces a module global of the assistant for the duration of a benchmark."""
+    previous = getattr(openai_assistant, name)
+    setattr(openai_assistant, name, value)
+    try:
+        yield value
+    finally:
+        setattr(openai_assistant, name, previous)
+
+
+class running_archiver:
+    """Swaps in a started archiver writing to a temp directory, as in production."""
+
+    def __init__(self, queue_size=settings.ARCHIVE_QUEUE_SIZE):
+        self.queue_size = queue_size
+
+    def __enter__(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.previous = openai_assistant.archiver
+        openai_assistant.archiver = SessionArchiver(
+            self.directory.name,
+            writers=settings.ARCHIVE_WRITERS,
+            queue_size=self.queue_size,
+            reserved_size=settings.ARCHIVE_RESERVED_SIZE,
+            max_bytes=settings.ARCHIVE_MAX_BYTES,
+            max_seconds=settings.ARCHIVE_MAX_SECONDS,
+            compress=settings.ARCHIVE_COMPRESS,
+        )
+        openai_assistant.archiver.start()
+        return openai_assistant.archiver
+
+    def __exit__(self, *exc):
+        openai_assistant.archiver.stop()
+        openai_assistant.archiver = self.previous
+        self.directory.cleanup()
+
+
+class Measurement:
+    """Times the block on the current thread and optionally traces its allocations.
+
+    tracemalloc cannot be limited to one thread, so the allocation columns also
+    include whatever the archive writer threads allocate while the block runs.
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.wall = self.cpu = 0.0
+        self.peak = self.retained = 0
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        self.wall = time.perf_counter()
+        # Thread time, so the archive writer threads don't count as event-loop time
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.thread_time() - self.cpu
+        if self.trace:
+            self.retained, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+
+async def bench_ingest(ops, measurement):
+    assistant = make_assistant(frames=ops)
+    # A live session sends four frames a second, which the writers easily keep up
+    # with. Room for every frame keeps the flood on the accepted path, not the drop path.
+    with patched('deepgram', FakeDeepgramClient()), running_archiver(queue_size=ops):
+        with measurement:
+            await assistant.transcribe_audio()
+    await assistant.httpx_client.aclose()
+
+
+async def bench_transcript_assembly(ops, measurement):
+    client = FakeDeepgramClient()
+    assistant = make_assistant()
+    # Registers the handlers, then returns after the single fake frame
+    with patched('deepgram', client):
+        await assistant.transcribe_audio()
+    on_message = client.connection.handlers[LiveTranscriptionEvents.Transcript]
+    on_utterance_end = client.connection.handlers[LiveTranscriptionEvents.UtteranceEnd]
+    interim = [transcript_result(sentence, False) for sentence in UTTERANCE]
+    final = transcript_result(UTTERANCE[-1], True)
+    speech_final = transcript_result('and tomorrow?', True, speech_final=True)
+    queue = assistant.transcript_queue
+    # One utterance is six events: three interim, two final and an utterance end
+    with measurement:
+        for _ in range(ops // 6):
+            for result in interim:
+                await on_message(client.connection, result)
+            await on_message(client.connection, final)
+            await on_message(client.connection, speech_final)
+            await on_utterance_end(client.connection, None)
+            while not queue.empty():
+                queue.get_nowait()
+    await assistant.httpx_client.aclose()
+
+
+async def bench_should_end_conversation(ops, measurement):
+    assistant = make_assistant()
+    texts = (END_TEXTS * (ops // len(END_TEXTS) + 1))[:ops]
+    with measurement:
+        for text in texts:
+            assistant.should_end_conversation(text)
+    await assistant.httpx_client.aclose()
+
+
+async def bench_manage_conversation(ops, measurement, history=200):
+    assistant = make_assistant()
+
+    async def assistant_chat(messages):
+        return TTS_TEXT
+
+    async def text_to_speech(text):
+        pass
+
+    assistant.assistant_chat = assistant_chat
+    assistant.text_to_speech = text_to_speech
+    for index in range(history):
+        role = 'user' if index % 2 == 0 else 'assistant'
+        assistant.chat_messages.append({'role': role, 'content': END_TEXTS[1]})
+    for _ in range(ops):
+        assistant.transcript_queue.put_nowait({'type': 'speech_final', 'content': END_TEXTS[1]})
+    assistant.transcript_queue.put_nowait({'type': 'speech_final', 'content': 'bye'})
+    with running_archiver():
+        with measurement:
+            await assistant.manage_conversation()
+    await assistant.httpx_client.aclose()
+
+
+async def bench_text_to_speech(ops, measurement):
+    # Unlimited budgets so we time chunk forwarding, not throttling
+    scheduler = UpstreamScheduler(
+        {'deepgram_tts': ProviderLimits(max_concurrency=1000, tokens_per_minute=10**12)}
+    )
+    assistant = make_assistant()
+    await assistant.httpx_client.aclose()
+    assistant.httpx_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, content=TTS_AUDIO))
+    )
+    with patched('scheduler', scheduler):
+        with measurement:
+            for _ in range(ops):
+                await assistant.text_to_speech(TTS_TEXT)
+    await assistant.httpx_client.aclose()
+
+
+@dataclass
+class Benchmark:
+    name: str
+    run: Callable
+    ops: int
+    # Operations in a reference session: five minutes of audio in the frontend's
+    # 250 ms MediaRecorder chunks and twenty conversational turns
+    per_session: int
+
+
+BENCHMARKS = [
+    Benchmark('ingest', bench_ingest, 20000, 1200),
+    Benchmark('transcript_assembly', bench_transcript_assembly, 60000, 120),
+    Benchmark('should_end_conversation', bench_should_end_conversation, 100000, 20),
+    Benchmark('manage_conversation', bench_manage_conversation, 20000, 20),
+    Benchmark('text_to_speech', bench_text_to_speech, 500, 20),
+]
+
+
+def measure(benchmark, repeat, scale):
+    ops = max(6, int(benchmark.ops * scale))
+    timings = []
+    for _ in range(repeat):
+        measurement = Measurement()
+        asyncio.run(benchmark.run(ops, measurement))
+        timings.append(measurement)
+    best = min(timings, key=lambda m: m.wall)
+    traced = Measurement(trace=True)
+    asyncio.run(benchmark.run(ops, traced))
+    return {
+        'ops_per_sec': ops / best.wall,
+        'cpu_us_per_op': best.cpu / ops * 1e6,
+        'peak_kib': traced.peak / 1024,
+        'retained_bytes_per_op': traced.retained / ops,
+        'loop_ms_per_session': best.cpu / ops * benchmark.per_session * 1000,
+    }
+
+
+# Baseline comparisons gate on event-loop CPU, not wall time: wall time includes
+# GIL contention from the archive writer threads and varies with machine load.
+COMPARED = [
+    ('loop_ms_per_session', 'loop ms/session', '.3f', 0.0),
+    # Retained bytes are often near zero, so allow a few bytes of noise on top
+    ('retained_bytes_per_op', 'kept B/op', '.1f', 8.0),
+]
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for metric, label, fmt, slack in COMPARED:
+        print(f'\n{"benchmark":<26}{"baseline " + label:>24}{"current " + label:>24}{"change":>10}')
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name][metric], result[metric]
+            change = after / before - 1 if before else 0.0
+            flag = ''
+            if after > before * (1 + threshold) + slack:
+                regressions.append((name, metric))
+                flag = '  REGRESSION'
+            print(f'{name:<26}{before:>24{fmt}}{after:>24{fmt}}{change:>+10.1%}{flag}')
+    return regressions
+
+
+def report(results):
+    print(f'{"benchmark":<26}{"ops/s":>14}{"cpu us/op":>12}{"peak KiB":>11}{"kept B/op":>11}{"loop ms/session":>17}')
+    for name, result in results.items():
+        print(
+            f'{name:<26}{result["ops_per_sec"]:>14,.0f}{result["cpu_us_per_op"]:>12.2f}'
+            f'{result["peak_kib"]:>11.1f}{result["retained_bytes_per_op"]:>11.1f}'
+            f'{result["loop_ms_per_session"]:>17.2f}'
+        )
+    total = sum(result['loop_ms_per_session'] for result in results.values())
+    print(f'{"total":<26}{"":>48}{total:>17.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-session hot paths.')
+    parser.add_argument('--only', nargs='+', choices=[b.name for b in BENCHMARKS])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the number of operations')
+    parser.add_argument('--save', metavar='PATH', help='write results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed growth in loop time or retained bytes, e.g. 0.1 for 10%%')
+    args = parser.parse_args()
+
+    # The server logs at INFO through uvicorn; keep that cost in the numbers
+    uvicorn_logger = logging.getLogger('uvicorn')
+    uvicorn_logger.setLevel(logging.INFO)
+    uvicorn_logger.addHandler(logging.NullHandler())
+    uvicorn_logger.propagate = False
+
+    results = {
+        benchmark.name: measure(benchmark, args.repeat, args.scale)
+        for benchmark in BENCHMARKS
+        if not args.only or benchmark.name in args.only
+    }
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+
+# Settings require API keys at import time; the tests never call out
+os.environ.setdefault('DEEPGRAM_API_KEY', 'test')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from app.scheduler import UpstreamScheduler, ProviderLimits
+
+UNLIMITED = 10**9
+
+
+def run(main):
+    # A lost slot shows up as a hang; fail fast instead
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
+
+
+def make_scheduler(max_concurrency=1, tokens_per_minute=UNLIMITED, short_request_cost=0):
+    return UpstreamScheduler({'p': ProviderLimits(max_concurrency, tokens_per_minute, short_request_cost)})
+
+
+async def hold_slot(scheduler, session_id, cost=1):
+    # Occupies the only slot so that later requests queue up behind it
+    slot = scheduler.slot('p', session_id, cost)
+    await slot.__aenter__()
+    return slot
+
+
+async def run_queued(scheduler, requests):
+    """Queues (session_id, cost, first_turn) requests behind a held slot and returns the run order."""
+    order = []
+
+    async def request(session_id, cost, first_turn):
+        async with scheduler.slot('p', session_id, cost, first_turn):
+            order.append(session_id)
+            await asyncio.sleep(0)
+
+    blocker = await hold_slot(scheduler, 'blocker')
+    tasks = []
+    for session_id, cost, first_turn in requests:
+        tasks.append(asyncio.create_task(request(session_id, cost, first_turn)))
+        await asyncio.sleep(0)
+    await blocker.__aexit__(None, None, None)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def assert_idle(scheduler):
+    state = scheduler.providers['p']
+    assert state.in_flight == 0
+    assert state.session_tags == {}
+    assert state.session_requests == {}
+
+
+def test_busy_session_does_not_starve_others():
+    async def main():
+        scheduler = make_scheduler(short_request_cost=200)
+        order = await run_queued(scheduler, [('a', 100, False)] * 20 + [('b', 500, False)])
+        # b costs five of a's requests, so it waits for about five of them, not all twenty
+        assert order.index('b') <= 6
+        assert_idle(scheduler)
+
+    run(main)
+
+
+def test_first_turn_goes_ahead_of_queued_requests():
+    async def main():
+        scheduler = make_scheduler()
+        order = await run_queued(scheduler, [('a', 100, False)] * 5 + [('new', 100, True)])
+        assert order[0] == 'new'
+
+    run(main)
+
+
+def test_priority_discount_is_bounded():
+    async def main():
+        scheduler = make_scheduler()
+        requests = []
+        for _ in range(10):
+            requests += [('eager', 100, True), ('plain', 100, False)]
+        order = await run_queued(scheduler, requests)
+        # Priority on every request must not let one session run away with the provider
+        for prefix in range(1, len(order) + 1):
+            served = order[:prefix]
+            assert served.count('eager') - served.count('plain') <= 1
+
+    run(main)
+
+
+def test_cancel_while_queued():
+    async def main():
+        scheduler = make_scheduler()
+        order = []
+
+        async def request(session_id):
+            async with scheduler.slot('p', session_id, 10):
+                order.append(session_id)
+
+        blocker = await hold_slot(scheduler, 'blocker')
+        cancelled = asyncio.create_task(request('cancelled'))
+        waiting = asyncio.create_task(request('waiting'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        await blocker.__aexit__(None, None, None)
+        await asyncio.gather(cancelled, waiting, return_exceptions=True)
+        assert order == ['waiting']
+        assert_idle(scheduler)
+
+    run(main)
+
+
+def test_cancel_just_after_slot_is_granted():
+    async def main():
+        scheduler = make_scheduler()
+        order = []
+
+        async def request(session_id):
+            async with scheduler.slot('p', session_id, 10):
+                order.append(session_id)
+
+        blocker = await hold_slot(scheduler, 'blocker')
+        granted = asyncio.create_task(request('granted'))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(request('waiting'))
+        await asyncio.sleep(0)
+        # Releasing hands the slot to `granted`; cancel it before it gets to run
+        await blocker.__aexit__(None, None, None)
+        assert scheduler.providers['p'].in_flight == 1
+        granted.cancel()
+        await asyncio.gather(granted, waiting, return_exceptions=True)
+        assert granted.cancelled()
+        assert order == ['waiting']
+        assert_idle(scheduler)
+
+    run(main)
+
+
+def test_budget_refills_over_time():
+    async def main():
+        # 6000 tokens a minute is 100 a second
+        scheduler = make_scheduler(max_concurrency=10, tokens_per_minute=6000)
+        async with scheduler.slot('p', 'a', 6000):
+            pass
+        started = time.monotonic()
+        async with scheduler.slot('p', 'a', 50):
+            pass
+        assert 0.4 <= time.monotonic() - started < 1.5
+
+    run(main)
+
+
+def test_reported_usage_overdraws_the_budget():
+    async def main():
+        # 60000 tokens a minute is 1000 a second
+        scheduler = make_scheduler(max_concurrency=10, tokens_per_minute=60000)
+        async with scheduler.slot('p', 'a', 100) as grant:
+            grant.used = 60100
+        assert scheduler.providers['p'].tokens < 0
+        started = time.monotonic()
+        async with scheduler.slot('p', 'a', 100):
+            pass
+        assert time.monotonic() - started >= 0.15
+
+    run(main)
+
+
+def test_reported_usage_refunds_the_budget():
+    async def main():
+        scheduler = make_scheduler(max_concurrency=10, tokens_per_minute=1000)
+        async with scheduler.slot('p', 'a', 1000) as grant:
+            grant.used = 10
+        started = time.monotonic()
+        async with scheduler.slot('p', 'a', 900):
+            pass
+        assert time.monotonic() - started < 0.1
+
+    run(main)
+
+
+def test_metrics_report_windowed_percentiles():
+    async def main():
+        scheduler = make_scheduler()
+        await run_queued(scheduler, [(str(index), 10, False) for index in range(20)])
+        metrics = scheduler.metrics()['p']
+        assert metrics['requests'] == 21
+        assert metrics['window_requests'] == 21
+        assert metrics['window_wait_p50_seconds'] <= metrics['window_wait_p99_seconds']
+
+    run(main)